@@ -1,10 +1,27 @@
+import pytz
 import requests
-from typing import Dict, List
+from typing import Callable, Dict, List, Optional, Tuple
 import datetime
+import difflib
+import functools
+import logging
+import random
+import threading
+import time
+
+import config
+from normalize import normalize_name
+from transport import Transport
 
 
 requests.urllib3.disable_warnings()
 
+logger = logging.getLogger(__name__)
+
+transport = Transport(
+    config.http_pool_connections, config.http_pool_maxsize, config.http_per_host_limit, config.http_timeout
+)
+
 KUPAT_API_URL = "https://tickets.kupat.co.il/api/presentations"
 LEAAN_API_URL = "https://www.leaan.co.il/feed/events?"
 LEAAN_API_MUSIC_URL = f"{LEAAN_API_URL}genreId=9bdf635c-4958-4cb1-a714-94067933ffc3&json"
@@ -14,20 +31,77 @@ EVENTIM_API_STANDUP_URL = "https://public-api.eventim.com/websearch/search/api/e
 COMEDYBAR_API_URL = "https://comedybar.smarticket.co.il/iframe/api/shows"
 CASTILIA_API_URL = "https://tickets.castilia.co.il/iframe/api/shows"
 
+# Kupat and Leaan report minutes while Eventim, Comedy Bar and Castilia add seconds
+EVENT_DATE_FORMATS = ("%H:%M %d/%m/%Y", "%H:%M:%S %d/%m/%Y")
+EVENT_DATE_FORMAT = "%H:%M %d/%m/%Y"
+# Kupat's sale start is reformatted, Leaan's is passed through as the site sends it
+SALE_START_FORMATS = ("%H:%M:%S %d/%m/%Y", "%Y-%m-%dT%H:%M:%S")
+VENUE_SIMILARITY_THRESHOLD = 0.6
+# shorter names are too common to tell a venue by being contained in another name
+MIN_VENUE_CONTAINMENT_LENGTH = 4
+
+EVENTIM_CATALOG = "catalog"
+EVENTIM_SEARCH = "search"
+# Average pages per Eventim crawl, seeded with a guess and updated from every crawl actually made.
+# Concerts and standups are both read from the live shows listing, so they share the estimates.
+eventim_page_counts = {EVENTIM_CATALOG: 10.0, EVENTIM_SEARCH: 1.0}
+PAGE_COUNT_SMOOTHING = 0.3
+# every this many plans the strategy not chosen is tried once, so its estimate does not go stale
+EVENTIM_PROBE_INTERVAL = 10
+eventim_plans_since_probe = 0
+# the last complete catalog crawl, (crawled at, shows), reused by concerts and standups while fresh
+eventim_catalog: Optional[Tuple[float, List[Dict]]] = None
+eventim_catalog_lock = threading.Lock()
+
 
 def format_datetime(date_str: str, from_format: str, to_format: str) -> str:
     return datetime.datetime.strftime(datetime.datetime.strptime(date_str, from_format), to_format)
 
 
-def get_eventim_shows(url, standup: bool = False) -> List[Dict]:
-    def filter(show):
-        standup_filter = {"name": "סטנדאפ ובידור"}
-        if standup:
-            return standup_filter in show["categories"]
-        return standup_filter not in show["categories"]
+def record_eventim_pages(strategy: str, pages: int):
+    eventim_page_counts[strategy] = (
+        1 - PAGE_COUNT_SMOOTHING
+    ) * eventim_page_counts[strategy] + PAGE_COUNT_SMOOTHING * pages
+
+
+def eventim_catalog_is_fresh() -> bool:
+    return eventim_catalog is not None and time.monotonic() - eventim_catalog[0] < config.eventim_catalog_ttl
+
+
+def plan_eventim_crawl(category: str, search_count: int) -> Tuple[str, float, bool]:
+    # One unfiltered crawl covers every artist, targeted searches (one per spelling) only pay off for a few artists
+    global eventim_plans_since_probe
+    catalog_cost = 0.0 if eventim_catalog_is_fresh() else eventim_page_counts[EVENTIM_CATALOG]
+    search_cost = search_count * eventim_page_counts[EVENTIM_SEARCH]
+    if catalog_cost <= search_cost:
+        strategy, cost = EVENTIM_CATALOG, catalog_cost
+    else:
+        strategy, cost = EVENTIM_SEARCH, search_cost
+    # The estimate of the strategy not chosen is only updated by probing it now and then,
+    # a catalog crawl instead of this run's searches, or a single search next to the catalog
+    eventim_plans_since_probe += 1
+    probe_search = False
+    if eventim_plans_since_probe >= EVENTIM_PROBE_INTERVAL and search_count:
+        eventim_plans_since_probe = 0
+        if strategy == EVENTIM_SEARCH:
+            strategy, cost = EVENTIM_CATALOG, catalog_cost
+        else:
+            probe_search = True
+            cost += eventim_page_counts[EVENTIM_SEARCH]
+    logger.info(
+        "Eventim %s plan for %s searches: %s%s (~%.1f pages, catalog ~%.1f, searches ~%.1f)",
+        category,
+        search_count,
+        strategy,
+        " and a probing search" if probe_search else "",
+        cost,
+        catalog_cost,
+        search_cost,
+    )
+    return strategy, cost, probe_search
 
-    events = []
-    session = requests.Session()
+
+def crawl_eventim(url: str) -> List[Dict]:
     headers = {
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/113.0.0.0 Safari/537.36 OPR/99.0.0.0",
         "accept-encoding": "gzip, deflate, br",
@@ -41,18 +115,49 @@ def get_eventim_shows(url, standup: bool = False) -> List[Dict]:
         "origin": "https://www.eventim.co.il",
         "referer": "https://www.eventim.co.il",
     }
+    strategy = EVENTIM_SEARCH if "search_term=" in url else EVENTIM_CATALOG
+    shows = []
+    pages = 0
     while True:
-        resp = session.get(url, verify=False, headers=headers)
+        pages += 1
+        resp = transport.get(url, verify=False, headers=headers)
         try:
-            events.extend(show for show in resp.json()["productGroups"] if filter(show))
-            url = resp.json()["_links"]["next"]["href"].replace("/search/", "/websearch/search/")
-        except (KeyError, requests.exceptions.RequestException):
+            resp.raise_for_status()
+            page = resp.json()
+            shows.extend(page["productGroups"])
+        except (KeyError, ValueError, requests.exceptions.RequestException) as e:
+            # an error page fails the whole crawl, a truncated listing would pass for the full one
+            raise requests.exceptions.RequestException(f"Eventim page {pages} is not a listing: {url}") from e
+        next_link = page.get("_links", {}).get("next")
+        if not next_link:
             break
-    return events
+        url = next_link["href"].replace("/search/", "/websearch/search/")
+    record_eventim_pages(strategy, pages)
+    return shows
+
+
+def get_eventim_catalog() -> List[Dict]:
+    global eventim_catalog
+    # held while crawling, so a concurrent caller waits for this crawl instead of starting another
+    with eventim_catalog_lock:
+        if not eventim_catalog_is_fresh():
+            eventim_catalog = (time.monotonic(), crawl_eventim(EVENTIM_API_LIVE_SHOWS_URL))
+        return eventim_catalog[1]
+
+
+def get_eventim_shows(url, standup: bool = False) -> List[Dict]:
+    def filter(show):
+        standup_filter = {"name": "סטנדאפ ובידור"}
+        if standup:
+            return standup_filter in show["categories"]
+        return standup_filter not in show["categories"]
+
+    shows = get_eventim_catalog() if url == EVENTIM_API_LIVE_SHOWS_URL else crawl_eventim(url)
+    return [show for show in shows if filter(show)]
 
 
 def get_kupat_concerts() -> List[Dict]:
-    resp = requests.get(KUPAT_API_URL, verify=False)
+    resp = transport.get(KUPAT_API_URL, verify=False)
     resp.raise_for_status()
     presentations = resp.json()["presentations"]
     concerts = []
@@ -75,7 +180,7 @@ def get_kupat_concerts() -> List[Dict]:
 
 
 def get_leaan_concerts() -> List[Dict]:
-    resp = requests.get(LEAAN_API_MUSIC_URL, verify=False)
+    resp = transport.get(LEAAN_API_MUSIC_URL, verify=False)
     resp.raise_for_status()
     events = resp.json()["feed"]["Events"]["Event"]
     concerts = []
@@ -119,25 +224,96 @@ def get_eventim_concerts(search_term=None) -> List[Dict]:
     return concerts
 
 
+def get_concert_sources(eventim_search_term=None) -> Dict[str, Callable[[], List[Dict]]]:
+    return {
+        "Kupat": get_kupat_concerts,
+        "Leaan": get_leaan_concerts,
+        "Eventim": functools.partial(get_eventim_concerts, search_term=eventim_search_term),
+    }
+
+
 def get_concerts(eventim_search_term=None) -> List[Dict]:
-    return get_kupat_concerts() + get_leaan_concerts() + get_eventim_concerts(search_term=eventim_search_term)
+    return [concert for source in get_concert_sources(eventim_search_term).values() for concert in source()]
 
 
-def get_concerts_for_singer(singer: str) -> List[Dict]:
-    concerts = {}
-    for concert in get_concerts(eventim_search_term=singer):
-        if singer.lower() in concert["title"].lower():
-            id = concert["date"]
-            if id in concerts:
-                concerts[id]["url"].append(concert["url"])
-            else:
-                concerts[id] = concert
-                concert["url"] = [concert["url"]]
-    return list(concerts.values())
+def title_matches(title: str, aliases: List[str]) -> bool:
+    title = normalize_name(title)
+    return any(alias in title for alias in aliases)
+
+
+def parse_event_date(date_str: str) -> Optional[datetime.datetime]:
+    for date_format in EVENT_DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(date_str, date_format).replace(second=0)
+        except ValueError:
+            continue
+    return None
+
+
+def parse_sale_start(sale_start: Optional[str]) -> Optional[datetime.datetime]:
+    # Sites publish local Israeli times, the scheduler and Mongo work with naive UTC datetimes
+    for date_format in SALE_START_FORMATS:
+        try:
+            local_time = datetime.datetime.strptime(sale_start or "", date_format)
+        except ValueError:
+            continue
+        local_time = pytz.timezone(config.sites_timezone).localize(local_time)
+        return local_time.astimezone(pytz.utc).replace(tzinfo=None)
+    return None
+
+
+def split_venue(venue: str) -> Tuple[str, str]:
+    # Eventim appends the city after a comma, the other sites usually only name the hall
+    name, _, city = venue.partition(",")
+    return normalize_name(name), normalize_name(city)
+
+
+def similar_names(first: str, second: str) -> bool:
+    shorter, longer = sorted((first, second), key=len)
+    if len(shorter) >= MIN_VENUE_CONTAINMENT_LENGTH and shorter in longer:
+        return True
+    return difflib.SequenceMatcher(None, first, second).ratio() >= VENUE_SIMILARITY_THRESHOLD
+
+
+def venues_match(first: str, second: str) -> bool:
+    first_name, first_city = split_venue(first)
+    second_name, second_city = split_venue(second)
+    if not first_name or not second_name or not similar_names(first_name, second_name):
+        return False
+    # the city only tells venues apart when both sites name it
+    return not first_city or not second_city or similar_names(first_city, second_city)
+
+
+def merge_duplicate_events(events: List[Dict]) -> List[Dict]:
+    merged: Dict[object, List[Dict]] = {}
+    for event in events:
+        start = parse_event_date(event["date"])
+        same_time = merged.setdefault(start or event["date"], [])
+        for known in same_time:
+            if venues_match(known["venue"], event["venue"]):
+                if event["url"] not in known["url"]:
+                    known["url"].append(event["url"])
+                for key, value in event.items():
+                    if key != "url" and not known.get(key):
+                        known[key] = value
+                break
+        else:
+            date = start.strftime(EVENT_DATE_FORMAT) if start else event["date"]
+            same_time.append(dict(event, date=date, url=[event["url"]]))
+    return [event for same_time in merged.values() for event in same_time]
+
+
+def filter_concerts_for_singer(concerts: List[Dict], singer: str, aliases: Optional[List[str]] = None) -> List[Dict]:
+    aliases = aliases or [normalize_name(singer)]
+    return merge_duplicate_events([concert for concert in concerts if title_matches(concert["title"], aliases)])
+
+
+def get_concerts_for_singer(singer: str, aliases: Optional[List[str]] = None) -> List[Dict]:
+    return filter_concerts_for_singer(get_concerts(eventim_search_term=singer), singer, aliases)
 
 
 def get_leaan_standups() -> List[Dict]:
-    resp = requests.get(LEAAN_API_STANDUP_URL, verify=False)
+    resp = transport.get(LEAAN_API_STANDUP_URL, verify=False)
     resp.raise_for_status()
     events = resp.json()["feed"]["Events"]["Event"]
     standups = []
@@ -156,7 +332,7 @@ def get_leaan_standups() -> List[Dict]:
 
 
 def get_comedybar_standups() -> List[Dict]:
-    resp = requests.get(COMEDYBAR_API_URL, verify=False)
+    resp = transport.get(COMEDYBAR_API_URL, verify=False)
     resp.raise_for_status()
     standups = []
     for show in resp.json():
@@ -174,7 +350,7 @@ def get_comedybar_standups() -> List[Dict]:
 
 
 def get_castilia_standups() -> List[Dict]:
-    resp = requests.get(CASTILIA_API_URL, verify=False)
+    resp = transport.get(CASTILIA_API_URL, verify=False)
     resp.raise_for_status()
     standups = []
     for show in resp.json():
@@ -215,23 +391,64 @@ def get_eventim_standups(search_term=None) -> List[Dict]:
     return standups
 
 
+def get_standup_sources(eventim_search_term=None) -> Dict[str, Callable[[], List[Dict]]]:
+    return {
+        "Castilia": get_castilia_standups,
+        "Comedy Bar": get_comedybar_standups,
+        "Eventim": functools.partial(get_eventim_standups, search_term=eventim_search_term),
+        "Leaan": get_leaan_standups,
+    }
+
+
 def get_standups(eventim_search_term=None) -> List[Dict]:
-    return (
-        get_castilia_standups()
-        + get_comedybar_standups()
-        + get_eventim_standups(search_term=eventim_search_term)
-        + get_leaan_standups()
-    )
+    return [standup for source in get_standup_sources(eventim_search_term).values() for standup in source()]
+
+
+def filter_standups_for_comedian(
+    standups: List[Dict], comedian: str, aliases: Optional[List[str]] = None
+) -> List[Dict]:
+    aliases = aliases or [normalize_name(comedian)]
+    return merge_duplicate_events([standup for standup in standups if title_matches(standup["title"], aliases)])
+
+
+def get_standups_for_comedian(comedian: str, aliases: Optional[List[str]] = None) -> List[Dict]:
+    return filter_standups_for_comedian(get_standups(eventim_search_term=comedian), comedian, aliases)
+
+
+def eventim_search_terms(artist: Dict) -> List[str]:
+    # Listings may be titled in any of the artist's spellings, e.g. in English for an artist registered in Hebrew
+    key = normalize_name(artist["name"])
+    return [artist["name"]] + [alias for alias in artist["aliases"] if alias != key]
+
+
+def search_spellings(get_sources: Callable, source: str, terms: List[str]) -> List[Dict]:
+    # several spellings of one artist may find the same listing
+    events = {}
+    for term in terms:
+        for event in get_sources(eventim_search_term=term)[source]():
+            events[(event["url"], event["date"])] = event
+    return list(events.values())
 
 
-def get_standups_for_comedian(comedian: str) -> List[Dict]:
-    standups = {}
-    for standup in get_standups(eventim_search_term=comedian):
-        if comedian in standup["title"]:
-            id = standup["date"]
-            if id in standups:
-                standups[id]["url"].append(standup["url"])
-            else:
-                standup["url"] = [standup["url"]]
-                standups[id] = standup
-    return list(standups.values())
+def get_source_events_for_artists(
+    category: str, source: str, artists: List[Dict], full_catalog: bool = False
+) -> Tuple[List[Dict], Dict[str, List[Dict]], bool]:
+    # The events are the source's whole catalog unless Eventim was searched per artist, which the flag tells
+    get_sources = get_concert_sources if category == "concerts" else get_standup_sources
+    filter_events = filter_concerts_for_singer if category == "concerts" else filter_standups_for_comedian
+    search_terms = {artist["_id"]: eventim_search_terms(artist) for artist in artists}
+    strategy, probe_search = EVENTIM_CATALOG, False
+    if source == "Eventim" and not full_catalog:
+        strategy, _, probe_search = plan_eventim_crawl(category, sum(len(terms) for terms in search_terms.values()))
+    if probe_search:
+        # only measures the pages of a search, the catalog crawl below already covers this artist
+        get_sources(eventim_search_term=random.choice(artists)["name"])[source]()
+    if strategy == EVENTIM_SEARCH:
+        found = {artist_id: search_spellings(get_sources, source, terms) for artist_id, terms in search_terms.items()}
+        events = [event for artist_events in found.values() for event in artist_events]
+    else:
+        events = get_sources()[source]()
+        found = {artist["_id"]: events for artist in artists}
+    return events, {
+        artist["_id"]: filter_events(found[artist["_id"]], artist["name"], artist["aliases"]) for artist in artists
+    }, strategy != EVENTIM_SEARCH
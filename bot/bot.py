@@ -1,8 +1,22 @@
+import asyncio
+import functools
 import logging
 import datetime
-from telegram import Update, User, BotCommand, InlineKeyboardButton, InlineKeyboardMarkup, ForceReply
+from telegram import (
+    Bot,
+    Update,
+    User,
+    BotCommand,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+    ForceReply,
+    Message,
+)
 from telegram.ext import (
     Application,
+    JobQueue,
     ApplicationBuilder,
     CallbackContext,
     CommandHandler,
@@ -10,15 +24,22 @@ from telegram.ext import (
     ConversationHandler,
     MessageHandler,
     CallbackQueryHandler,
+    InlineQueryHandler,
 )
 from telegram.constants import ParseMode
-from typing import Dict, Generator
+from telegram.error import TelegramError
+from typing import Callable, Dict, Generator, List, Optional, Set, Tuple
 from enum import Enum, auto
 import re
+import hashlib
 from requests.exceptions import RequestException
 
 import config
 from database import Database
+from normalize import normalize_name
+from scheduler import AdaptivePoller, SaleAlertHeap
+from search_index import PrefixIndex, index_words
+from pagination import ResultPages
 import api_queries
 
 
@@ -43,6 +64,11 @@ class States(Enum):
 
 
 MAX_MESSAGE_LENGTH = 4096
+# Telegram shows at most 50 results for an inline query
+MAX_INLINE_RESULTS = 50
+# leaves room for the page number and the sources status line appended to result pages
+PAGE_LENGTH = MAX_MESSAGE_LENGTH - 256
+RESULT_PAGE_PREFIX = "page:"
 
 
 HELP_MESSAGE = """
@@ -50,13 +76,33 @@ HELP_MESSAGE = """
 ⚪ /singer - הצג את תפריט ההופעות.
 ⚪ /standup - הצג את תפריט הסטנדאפ.
 ⚪ /help - הצג הודעה זו 
+⚪ ניתן לחפש הופעות מכל צ'אט על ידי הקלדת @GigMasterBot ושם הזמר או הסטנדאפיסט.
 
 ⚪ מומלץ לרשום את השם שמופיע בתמונה של ההופעה באתר של קופת תל-אביב, כיוון שלחלק מהזמרים שומרים את השם באנגלית *שיעול* נועה קירל *שיעול* 
-⚪ הבוט יחפש הופעות לזמרים ברשימת החיפוש כל שעה ויודיע אם מצא.
-⚪ בראשון בחודש, הבוט יחפש הופעות סטנדאפ לסטנדאפיסטים שברשימת החיפוש ויודיע אם מצא.
+⚪ הבוט יחפש הופעות לזמרים ולסטנדאפיסטים שברשימת החיפוש באופן קבוע, אתרים שמתעדכנים לעיתים קרובות ייבדקו בתדירות גבוהה יותר, ויודיע אם מצא.
 """
 
 db = Database()
+poller = AdaptivePoller(
+    config.source_poll_min_interval,
+    config.source_poll_max_interval,
+    config.source_poll_change_smoothing,
+    config.source_poll_initial_interval,
+    db.fetch_source_change_rates(),
+)
+sale_alerts = SaleAlertHeap()
+catalog_index = PrefixIndex()
+# (category, source) index groups whose last poll did not read the source's whole catalog
+stale_index_groups: Set[Tuple[str, str]] = set()
+result_pages = ResultPages(config.result_pages_ttl, config.result_page_size, PAGE_LENGTH)
+
+
+def is_allowed_user(user: Optional[User]) -> bool:
+    # the same check as user_filter, for the handlers that take no filters
+    if len(config.allowed_telegram_usernames) == 0:
+        return True
+    usernames = {u.lstrip("@") for u in config.allowed_telegram_usernames if isinstance(u, str)}
+    return user is not None and user.username in usernames
 
 
 async def register_user_if_not_exists(update: Update, user: User):
@@ -124,13 +170,133 @@ async def get_names_from_user(update: Update, context: CallbackContext) -> State
     return state
 
 
+def create_result_page_keyboard(key: str, page: int, page_count: int) -> Optional[InlineKeyboardMarkup]:
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton(text="הקודם", callback_data=f"{RESULT_PAGE_PREFIX}{key}:{page - 1}"))
+    if page < page_count - 1:
+        buttons.append(InlineKeyboardButton(text="הבא", callback_data=f"{RESULT_PAGE_PREFIX}{key}:{page + 1}"))
+    return InlineKeyboardMarkup([buttons]) if buttons else None
+
+
+async def send_result_pages(
+    bot: Bot,
+    chat_id: int,
+    header: str,
+    items: List[Dict],
+    format_item: Callable[[Dict], str],
+    parse_mode: Optional[str] = None,
+) -> Message:
+    # A single message holds the first page, the rest are shown by editing it from its navigation buttons
+    key = result_pages.add(header, items, format_item, parse_mode)
+    text, page_count = result_pages.render(key, 0)
+    return await bot.send_message(
+        chat_id=chat_id,
+        text=text,
+        parse_mode=parse_mode,
+        reply_markup=create_result_page_keyboard(key, 0, page_count),
+    )
+
+
+async def turn_result_page(update: Update, context: CallbackContext):
+    query = update.callback_query
+    if not is_allowed_user(query.from_user):
+        await query.answer()
+        return
+    key, page = query.data[len(RESULT_PAGE_PREFIX) :].rsplit(":", 1)
+    rendered = result_pages.render(key, int(page))
+    if rendered is None:
+        await query.answer("התוצאות כבר אינן זמינות, אנא חפשו שוב.", show_alert=True)
+        return
+    text, page_count = rendered
+    await query.answer()
+    await query.edit_message_text(
+        text,
+        parse_mode=result_pages.parse_mode(key),
+        reply_markup=create_result_page_keyboard(key, int(page), page_count),
+    )
+
+
+async def fetch_source(name: str, fetch: Callable[[], List[Dict]]) -> Tuple[str, Optional[List[Dict]]]:
+    try:
+        return name, await asyncio.get_running_loop().run_in_executor(None, fetch)
+    except Exception:
+        # a site answering in an unexpected shape fails alone, the others still get to the final edit
+        logger.exception("Failed to fetch results from %s", name)
+        return name, None
+
+
+async def stream_search_results(
+    update: Update,
+    sources: Dict[str, Callable[[], List[Dict]]],
+    filter_results: Callable[[List[Dict]], List[Dict]],
+    format_result: Callable[[Dict], str],
+    found_header: Callable[[int], str],
+    not_found_text: str,
+    parse_mode: Optional[str] = None,
+) -> bool:
+    # Sources run side by side and the reply is edited as each one returns, so a slow site only delays its own results
+    events, finished, failed = [], [], []
+    message: Optional[Message] = None
+    key = result_pages.add(not_found_text, [], format_result, parse_mode)
+    sent_text = ""
+    for next_source in asyncio.as_completed([fetch_source(name, fetch) for name, fetch in sources.items()]):
+        source, results = await next_source
+        if results is None:
+            failed.append(source)
+        else:
+            finished.append(source)
+            events.extend(results)
+        matches = filter_results(events)
+        pending = [name for name in sources if name not in finished and name not in failed]
+        if not matches and pending:
+            continue
+        if not pending and not finished:
+            break
+        if pending:
+            status = "ממתין לתוצאות מ: " + ", ".join(pending)
+        else:
+            status = "הושלם חיפוש ב: " + ", ".join(finished)
+            if failed:
+                status += "\nלא הצלחתי להתחבר ל: " + ", ".join(failed)
+        header = found_header(len(matches)) if matches else not_found_text
+        result_pages.update(key, header=header, items=matches, footer=status)
+        text, page_count = result_pages.render(key, 0)
+        if text == sent_text:
+            continue
+        # navigation only shows up once every site answered, so the streamed edits cannot flip a page under the user
+        reply_markup = None if pending else create_result_page_keyboard(key, 0, page_count)
+        if message is None:
+            message = await update.message.reply_text(text, parse_mode=parse_mode, reply_markup=reply_markup)
+        else:
+            await message.edit_text(text, parse_mode=parse_mode, reply_markup=reply_markup)
+        sent_text = text
+    return bool(finished)
+
+
 async def search_shows(update: Update, context: CallbackContext) -> States:
     for singer_name in parse_names(update.message.text):
         logger.warning(f"Searching shows of {singer_name} for user {update.message.from_user.id}")
         await update.effective_chat.send_action(action="typing")
         text = ""
+        artist = db.find_artist(singer_name)
+        aliases = artist["aliases"] if artist else None
+        if config.enable_message_streaming:
+            if not await stream_search_results(
+                update,
+                api_queries.get_concert_sources(eventim_search_term=singer_name),
+                lambda concerts: api_queries.filter_concerts_for_singer(concerts, singer_name, aliases),
+                format_concert,
+                lambda count: f"נמצאו {count} הופעות של {singer_name}:" + "\n",
+                f"לא נמצאו הופעות של {singer_name}",
+            ):
+                await update.message.reply_text("לא הצלחתי להתחבר לאתר, אנא נסו שנית עוד מספר שניות.")
+                return States.ACTION_BUTTON_CLICK
+            continue
         try:
-            concerts = api_queries.get_concerts_for_singer(singer_name)
+            concerts = await asyncio.get_running_loop().run_in_executor(
+                None, functools.partial(api_queries.get_concerts_for_singer, singer_name, aliases=aliases)
+            )
         except RequestException:
             logger.exception("Failed to connect to %s", api_queries.KUPAT_API_URL)
             await update.message.reply_text("לא הצלחתי להתחבר לאתר, אנא נסו שנית עוד מספר שניות.")
@@ -139,13 +305,7 @@ async def search_shows(update: Update, context: CallbackContext) -> States:
             text = f"לא נמצאו הופעות של {singer_name}"
         else:
             text = f"נמצאו {len(concerts)} הופעות של {singer_name}:" + "\n"
-            for concert in concerts:
-                concert_text = format_concert(concert) + "\n"
-                if len(text + concert_text) > 4096:
-                    await update.message.reply_text(text)
-                    text = ""
-                text += concert_text + "\n"
-        await update.message.reply_text(text)
+        await send_result_pages(context.bot, update.effective_chat.id, text, concerts, format_concert)
     return States.ACTION_BUTTON_CLICK
 
 
@@ -161,27 +321,178 @@ async def list_singers_handle(update: Update, context: CallbackContext) -> State
     return States.ACTION_BUTTON_CLICK
 
 
-async def search_shows_for_users(context: CallbackContext):
-    for user in db.user_collection.find():
-        logger.warning(f"Looking for shows for user {user['_id']}")
-        singers = db.fetch_singers(user["_id"])
-        for singer in singers:
-            try:
-                concerts = api_queries.get_concerts_for_singer(singer)
-            except RequestException:
-                logger.exception("Failed to reach %s for user %s", api_queries.KUPAT_API_URL, user["_id"])
+def schedule_next_poll(context: CallbackContext, events: Optional[List[Dict]]):
+    job = context.job
+    interval = poller.observe(job.name, events)
+    if events is not None:
+        db.save_source_change_rate(job.name, poller.change_rate(job.name))
+    context.job_queue.run_once(job.callback, when=interval, data=job.data, name=job.name)
+
+
+def schedule_sale_alerts(job_queue: JobQueue):
+    # A single job waits for the earliest sale opening, so nothing runs while no sale is about to open
+    next_sale_start = sale_alerts.peek()
+    if next_sale_start == sale_alerts.scheduled_at:
+        return
+    for job in job_queue.get_jobs_by_name("sale_alerts"):
+        job.schedule_removal()
+    sale_alerts.scheduled_at = next_sale_start
+    if next_sale_start:
+        delay = max((next_sale_start - datetime.datetime.utcnow()).total_seconds(), 0)
+        job_queue.run_once(notify_sale_openings, when=delay, name="sale_alerts")
+
+
+def track_sale_openings(job_queue: JobQueue, category: str, artist_events: Dict[str, List[Dict]]):
+    now = datetime.datetime.utcnow()
+    for artist_id, events in artist_events.items():
+        for event in events:
+            sale_start = api_queries.parse_sale_start(event.get("ticketSaleStart"))
+            if sale_start and sale_start > now:
+                alert_id = db.add_sale_alert(artist_id, category, event, sale_start)
+                if alert_id:
+                    sale_alerts.push(sale_start, alert_id)
+    schedule_sale_alerts(job_queue)
+
+
+async def send_sale_alert(context: CallbackContext, alert: Dict):
+    list_field = "singers_id" if alert["category"] == "concerts" else "comedians_id"
+    artist = db.fetch_artists([alert["artist_id"]])
+    name = artist[0]["name"] if artist else alert["event"]["title"]
+    format_event = format_concert if alert["category"] == "concerts" else format_standup
+    text = f"מכירת הכרטיסים להופעה של {name} נפתחה עכשיו!" + "\n" + format_event(alert["event"])
+    for user in db.fetch_subscribers_of_artist(list_field, alert["artist_id"]):
+        try:
+            await context.bot.send_message(chat_id=user["chat_id"], text=text)
+        except TelegramError:
+            logger.exception("Failed to send sale alert %s to user %s", alert["_id"], user["_id"])
+
+
+async def notify_sale_openings(context: CallbackContext):
+    sale_alerts.scheduled_at = None
+    now = datetime.datetime.utcnow()
+    due = sale_alerts.pop_due(now)
+    try:
+        while due:
+            sale_start, alert_id = due.pop(0)
+            alert = db.fetch_sale_alert(alert_id)
+            if not alert:
                 continue
-            concerts = [concert for concert in concerts if not db.shown_concert(user["_id"], singer, concert["date"])]
-            if concerts:
-                text = f"נמצאו {len(concerts)} הופעות של {singer}:" + "\n"
-                for concert in concerts:
-                    concert_text = format_concert(concert) + "\n"
-                    if len(text + concert_text) > 4096:
-                        await context.bot.send_message(chat_id=user["chat_id"], text=text)
-                        text = ""
-                    text += concert_text
-                await context.bot.send_message(chat_id=user["chat_id"], text=text)
-                db.add_concerts(user["_id"], singer, concerts)
+            if (now - sale_start).total_seconds() > config.sale_alert_grace_period:
+                logger.warning("Dropping sale alert %s missed at %s", alert_id, sale_start)
+            else:
+                await send_sale_alert(context, alert)
+            # removed only once handled, an alert interrupted midway stays stored and is reloaded on startup
+            db.remove_sale_alert(alert_id)
+    finally:
+        for sale_start, alert_id in due:
+            sale_alerts.push(sale_start, alert_id)
+        schedule_sale_alerts(context.job_queue)
+
+
+def update_catalog_index(category: str, source: str, events: List[Dict], artists: List[Dict], artist_events: Dict):
+    # Events are searchable by their title and by the aliases of the artists they were matched to
+    aliases: Dict[Tuple[str, str, str], List[str]] = {}
+    for artist in artists:
+        for event in artist_events.get(artist["_id"], []):
+            for url in event["url"]:
+                aliases.setdefault((url, event["date"], event["title"]), []).extend(artist["aliases"])
+    entries = {}
+    for event in events:
+        date = api_queries.parse_event_date(event["date"])
+        date = date.strftime(api_queries.EVENT_DATE_FORMAT) if date else event["date"]
+        entry_id = f"{category}:{source}:{event['url']}:{date}"
+        entries[entry_id] = (
+            dict(event, category=category),
+            index_words(event["title"], *aliases.get((event["url"], date, event["title"]), [])),
+        )
+    catalog_index.replace_group(f"{category}:{source}", entries)
+
+
+async def refresh_catalog_index(context: CallbackContext):
+    # Only the groups no poll filled from a whole catalog are crawled, e.g. Eventim after per artist searches
+    for category, source in sorted(stale_index_groups):
+        list_field = "singers_id" if category == "concerts" else "comedians_id"
+        artists = db.fetch_artists(list(db.fetch_artist_subscribers(list_field)))
+        try:
+            events, artist_events, _ = await asyncio.get_running_loop().run_in_executor(
+                None,
+                functools.partial(
+                    api_queries.get_source_events_for_artists, category, source, artists, full_catalog=True
+                ),
+            )
+        except RequestException:
+            logger.exception("Failed to reach %s while indexing %s", source, category)
+            continue
+        update_catalog_index(category, source, events, artists, artist_events)
+        stale_index_groups.discard((category, source))
+
+
+async def inline_search(update: Update, context: CallbackContext):
+    if not is_allowed_user(update.inline_query.from_user):
+        await update.inline_query.answer([], cache_time=0, is_personal=True)
+        return
+    query = update.inline_query.query
+    # Only listings of the same show are merged, matches of different artists may share a venue and time
+    same_shows: Dict[Tuple[str, str], List[Dict]] = {}
+    for event in catalog_index.search(query) if query.strip() else []:
+        same_shows.setdefault((event["category"], normalize_name(event["title"])), []).append(event)
+    matches = sorted(
+        (event for events in same_shows.values() for event in api_queries.merge_duplicate_events(events)),
+        key=lambda event: api_queries.parse_event_date(event["date"]) or datetime.datetime.max,
+    )
+    results = []
+    for event in matches[:MAX_INLINE_RESULTS]:
+        format_event = format_concert if event["category"] == "concerts" else format_standup
+        results.append(
+            InlineQueryResultArticle(
+                id=hashlib.md5(f"{event['title']}{event['date']}{event['venue']}".encode()).hexdigest(),
+                title=event["title"],
+                description=f"{event['date']} | {event['venue']}",
+                input_message_content=InputTextMessageContent(format_event(event)),
+            )
+        )
+    # personal, so Telegram does not serve an allowed user's results to anyone else
+    await update.inline_query.answer(results, cache_time=60, is_personal=True)
+
+
+async def search_shows_for_users(context: CallbackContext):
+    source = context.job.data
+    events = None
+    try:
+        subscribers = db.fetch_artist_subscribers("singers_id")
+        logger.warning(f"Looking for shows of {len(subscribers)} singers on {source}")
+        artists = db.fetch_artists(list(subscribers))
+        # fetched off the event loop, waiting for a site's connection cap must not stall the handlers
+        events, artist_concerts, complete = await asyncio.get_running_loop().run_in_executor(
+            None, api_queries.get_source_events_for_artists, "concerts", source, artists
+        )
+    except RequestException:
+        logger.exception("Failed to reach %s while searching shows", source)
+        return
+    finally:
+        # the next poll is scheduled even when this one fails, otherwise the source would never be polled again
+        schedule_next_poll(context, events)
+    track_sale_openings(context.job_queue, "concerts", artist_concerts)
+    if complete:
+        update_catalog_index("concerts", source, events, artists, artist_concerts)
+        stale_index_groups.discard(("concerts", source))
+    else:
+        stale_index_groups.add(("concerts", source))
+    for artist in artists:
+        concerts = artist_concerts[artist["_id"]]
+        for user in subscribers[artist["_id"]]:
+            new_concerts = [
+                concert for concert in concerts if not db.shown_concert(user["_id"], artist["_id"], concert["date"])
+            ]
+            if new_concerts:
+                # Marked before sending since another source's poll may report the same show meanwhile
+                db.add_concerts(user["_id"], artist["_id"], new_concerts)
+                text = f"נמצאו {len(new_concerts)} הופעות של {artist['name']}:" + "\n"
+                try:
+                    await send_result_pages(context.bot, user["chat_id"], text, new_concerts, format_concert)
+                except TelegramError:
+                    logger.exception("Failed to send shows of %s to user %s", artist["name"], user["_id"])
+                    db.remove_concerts(user["_id"], artist["_id"], new_concerts)
 
 
 def format_concert(concert: Dict) -> str:
@@ -238,8 +549,25 @@ async def search_standups(update: Update, context: CallbackContext) -> States:
         logger.warning(f"Searching standups of {comedian_name} for user {update.message.from_user.id}")
         await update.message.chat.send_action(action="typing")
         text = ""
+        artist = db.find_artist(comedian_name)
+        aliases = artist["aliases"] if artist else None
+        if config.enable_message_streaming:
+            if not await stream_search_results(
+                update,
+                api_queries.get_standup_sources(eventim_search_term=comedian_name),
+                lambda standups: api_queries.filter_standups_for_comedian(standups, comedian_name, aliases),
+                format_standup,
+                lambda count: f"נמצאו {count} הופעות סטנדאפ של {comedian_name}:" + "\n",
+                f"לא נמצאו הופעות של {comedian_name}",
+                parse_mode=ParseMode.HTML,
+            ):
+                await update.message.reply_text("לא הצלחתי להתחבר לאתר, אנא נסו שנית בעוד מספר שניות.")
+                return States.ACTION_BUTTON_CLICK
+            continue
         try:
-            standups = api_queries.get_standups_for_comedian(comedian_name)
+            standups = await asyncio.get_running_loop().run_in_executor(
+                None, functools.partial(api_queries.get_standups_for_comedian, comedian_name, aliases=aliases)
+            )
         except RequestException:
             logger.exception(
                 "Failed to reach either site for user %s",
@@ -251,13 +579,9 @@ async def search_standups(update: Update, context: CallbackContext) -> States:
             text = f"לא נמצאו הופעות של {comedian_name}" ""
         else:
             text = f"נמצאו {len(standups)} הופעות סטנדאפ של {comedian_name}:" + "\n"
-            for standup in standups:
-                standup_text = format_standup(standup) + "\n"
-                if len(text + standup_text) > 4096:
-                    await update.message.reply_text(text)
-                    text = ""
-                text += standup_text
-        await update.message.reply_text(text, parse_mode=ParseMode.HTML)
+        await send_result_pages(
+            context.bot, update.effective_chat.id, text, standups, format_standup, parse_mode=ParseMode.HTML
+        )
     return States.ACTION_BUTTON_CLICK
 
 
@@ -269,31 +593,42 @@ def format_standup(standup: Dict) -> str:
 
 
 async def search_standups_for_users(context: CallbackContext):
-    for user in db.user_collection.find():
-        logger.warning(f"Looking for standups for user {user['_id']}")
-        comedian = db.fetch_comedians(user["_id"])
-        for comedian in comedian:
-            try:
-                standups = api_queries.get_standups_for_comedian(comedian)
-            except RequestException:
-                logger.exception(
-                    "Failed to reach site for user %s",
-                    user["_id"],
-                )
-                continue
-            standups = [
-                standup for standup in standups if not db.shown_standup(user["_id"], comedian + standup[0]["show_date"])
+    source = context.job.data
+    events = None
+    try:
+        subscribers = db.fetch_artist_subscribers("comedians_id")
+        logger.warning(f"Looking for standups of {len(subscribers)} comedians on {source}")
+        artists = db.fetch_artists(list(subscribers))
+        # fetched off the event loop, waiting for a site's connection cap must not stall the handlers
+        events, artist_standups, complete = await asyncio.get_running_loop().run_in_executor(
+            None, api_queries.get_source_events_for_artists, "standups", source, artists
+        )
+    except RequestException:
+        logger.exception("Failed to reach %s while searching standups", source)
+        return
+    finally:
+        # the next poll is scheduled even when this one fails, otherwise the source would never be polled again
+        schedule_next_poll(context, events)
+    track_sale_openings(context.job_queue, "standups", artist_standups)
+    if complete:
+        update_catalog_index("standups", source, events, artists, artist_standups)
+        stale_index_groups.discard(("standups", source))
+    else:
+        stale_index_groups.add(("standups", source))
+    for artist in artists:
+        standups = artist_standups[artist["_id"]]
+        for user in subscribers[artist["_id"]]:
+            new_standups = [
+                standup for standup in standups if not db.shown_standup(user["_id"], artist["_id"] + standup["date"])
             ]
-            text = f"נמצאו {len(standups)} הופעות של {comedian}:" + "\n"
-            if standups:
-                for standup in standups:
-                    standup_text = format_standup(standup) + "\n"
-                    if len(text + standup_text) > 4096:
-                        await context.bot.send_message(chat_id=user["chat_id"], text=text)
-                        text = ""
-                    text += standup_text
-                await context.bot.send_message(chat_id=user["chat_id"], text=text)
-                db.add_standups(user["_id"], comedian, standups)
+            if new_standups:
+                db.add_standups(user["_id"], artist["_id"], new_standups)
+                text = f"נמצאו {len(new_standups)} הופעות של {artist['name']}:" + "\n"
+                try:
+                    await send_result_pages(context.bot, user["chat_id"], text, new_standups, format_standup)
+                except TelegramError:
+                    logger.exception("Failed to send standups of %s to user %s", artist["name"], user["_id"])
+                    db.remove_standups(user["_id"], artist["_id"], new_standups)
 
 
 def create_main_menu_keyboard() -> InlineKeyboardMarkup:
@@ -379,6 +714,8 @@ async def start_over(update: Update, context: CallbackContext) -> States:
 
 
 async def post_init(app: Application):
+    db.migrate_names_to_artists()
+    db.normalize_shown_dates()
     await app.bot.set_my_commands(
         [
             BotCommand("/help", "הצג מסך עזרה"),
@@ -387,18 +724,28 @@ async def post_init(app: Application):
             BotCommand("/standup", "הצג תפריט סטנדאפ"),
         ]
     )
-    # interval in seconds
+    # every source is polled on its own, at a pace following how often it publishes new events
     starting_singers_time = datetime.datetime.now().time()
     starting_singers_time = starting_singers_time.replace(
         microsecond=0, second=0, minute=0, hour=(starting_singers_time.hour + 1) % 24
     )
+    for source in api_queries.get_concert_sources():
+        app.job_queue.run_once(
+            search_shows_for_users, when=starting_singers_time, data=source, name=f"concerts:{source}"
+        )
+    for source in api_queries.get_standup_sources():
+        app.job_queue.run_once(
+            search_standups_for_users, when=starting_singers_time, data=source, name=f"standups:{source}"
+        )
+    # every group is filled right away so inline queries are answered before the first poll
+    stale_index_groups.update(("concerts", source) for source in api_queries.get_concert_sources())
+    stale_index_groups.update(("standups", source) for source in api_queries.get_standup_sources())
     app.job_queue.run_repeating(
-        search_shows_for_users, interval=config.singers_search_interval, first=starting_singers_time
-    )
-    # datetime.time is in UTC
-    app.job_queue.run_monthly(
-        search_standups_for_users, day=1, when=datetime.time(hour=config.standup_search_hour, minute=0, second=00)
+        refresh_catalog_index, interval=config.catalog_index_interval, first=0, name="catalog_index"
     )
+    for alert in db.fetch_pending_sale_alerts():
+        sale_alerts.push(alert["sale_start"], alert["_id"])
+    schedule_sale_alerts(app.job_queue)
 
 
 def run_bot():
@@ -411,6 +758,11 @@ def run_bot():
         .post_init(post_init)
         .build()
     )
+    add_handlers(app)
+    app.run_polling(allowed_updates=Update.ALL_TYPES)
+
+
+def add_handlers(app: Application):
     user_filter = filters.ALL
     if len(config.allowed_telegram_usernames) > 0:
         usernames = [u for u in config.allowed_telegram_usernames if isinstance(u, str)]
@@ -448,7 +800,8 @@ def run_bot():
         allow_reentry=True,
     )
     app.add_handler(conv_handler)
-    app.run_polling(allowed_updates=Update.ALL_TYPES)
+    app.add_handler(InlineQueryHandler(inline_search))
+    app.add_handler(CallbackQueryHandler(turn_result_page, pattern=f"^{RESULT_PAGE_PREFIX}"))
 
 
 if __name__ == "__main__":
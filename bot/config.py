@@ -1,11 +1,38 @@
+import json
 import os
 
 
 telegram_token = os.getenv("TELEGRAM_TOKEN")
 allowed_telegram_usernames = []  # if empty, the bot is available to anyone.
-enable_message_streaming = True  # if set, messages will be shown to user word-by-word
+enable_message_streaming = True  # if set, search results are sent and edited as each site returns
 
-mongodb_uri = "mongodb://mongo:27017"
-singers_search_interval = int(os.getenv("SINGERS_SEARCH_INTERVAL", 3600))
-standup_search_hour = int(os.getenv("STANDUP_SEARCH_HOUR", 9))
+mongodb_uri = os.getenv("MONGODB_URI", "mongodb://mongo:27017")
+mongodb_database = os.getenv("MONGODB_DATABASE", "gigmaster")
+# every site is polled between these intervals (in seconds), more often the more it changes
+source_poll_min_interval = int(os.getenv("SOURCE_POLL_MIN_INTERVAL", 900))
+source_poll_max_interval = int(os.getenv("SOURCE_POLL_MAX_INTERVAL", 6 * 3600))
+source_poll_change_smoothing = float(os.getenv("SOURCE_POLL_CHANGE_SMOOTHING", 0.3))
+# a source with no change rate recorded yet starts at the former hourly pace
+source_poll_initial_interval = int(os.getenv("SOURCE_POLL_INITIAL_INTERVAL", 3600))
+# connections to the sites are pooled and kept alive, at most http_per_host_limit requests run per site at once
+http_pool_connections = int(os.getenv("HTTP_POOL_CONNECTIONS", 10))
+http_pool_maxsize = int(os.getenv("HTTP_POOL_MAXSIZE", 10))
+http_per_host_limit = int(os.getenv("HTTP_PER_HOST_LIMIT", 4))
+http_timeout = float(os.getenv("HTTP_TIMEOUT", 30))
+# a complete crawl of Eventim's listing serves both concerts and standups for this many seconds
+eventim_catalog_ttl = int(os.getenv("EVENTIM_CATALOG_TTL", 900))
+# index groups a poll could not fill from a whole catalog (Eventim after per artist searches) are crawled this often
+catalog_index_interval = int(os.getenv("CATALOG_INDEX_INTERVAL", 6 * 3600))
+sites_timezone = os.getenv("SITES_TIMEZONE", "Asia/Jerusalem")
+# sale opening alerts missed by more than this many seconds (e.g. while the bot was down) are dropped
+sale_alert_grace_period = int(os.getenv("SALE_ALERT_GRACE_PERIOD", 3600))
+# search results are kept this many seconds for paging through them, result_page_size events per page
+result_pages_ttl = int(os.getenv("RESULT_PAGES_TTL", 6 * 3600))
+result_page_size = int(os.getenv("RESULT_PAGE_SIZE", 5))
 prune_hour = int(os.getenv("PRUNE_HOUR", 20))
+# canonical artist name -> other spellings, seeded into the shared artists registry on startup,
+# more can be given without a code change as a JSON object in ARTIST_ALIASES
+artist_aliases = {
+    "נועה קירל": ["Noa Kirel"],
+    **json.loads(os.getenv("ARTIST_ALIASES", "{}")),
+}
@@ -1,28 +1,50 @@
-from typing import List, Dict
+from typing import List, Dict, Optional
+import datetime
 import pymongo
 import uuid
 import logging
+import re
 
 import config
+from normalize import normalize_name
 
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
+# shown event ids used to keep the seconds some sites report, "<artist>HH:MM:SS dd/mm/YYYY"
+SHOWN_ID_REGEX = re.compile(r"^(.*?)(\d{2}:\d{2}(?::\d{2})? \d{2}/\d{2}/\d{4})$")
+SHOWN_DATE_SECONDS_REGEX = re.compile(r"(\d{2}:\d{2}):\d{2}( \d{2}/\d{2}/\d{4})$")
+
 
 class Database:
     NAMES_SIZE_LIMIT = 20
+    # names list field -> (names collection, shown events field, shown events collection) of a user document,
+    # every collection keeps its list under a key named like the collection itself
+    ARTIST_LISTS = {
+        "singers_id": ("singers", "shown_concerts_id", "shown_concerts"),
+        "comedians_id": ("comedians", "shown_standups_id", "shown_standups"),
+    }
 
     def __init__(self):
         self.client = pymongo.MongoClient(config.mongodb_uri)
-        self.db = self.client["gigmaster"]
+        self.db = self.client[config.mongodb_database]
         logger.info("Initiated client and loaded DB")
         self.user_collection = self.db["users"]
         self.singers_collection = self.db["singers"]
         self.shown_concerts_collection = self.db["shown_concerts"]
         self.comedians_collection = self.db["comedians"]
+        # finds the lists following an artist without going through every user
+        self.singers_collection.create_index("singers")
+        self.comedians_collection.create_index("comedians")
         self.shown_standups_collection = self.db["shown_standups"]
+        self.artists_collection = self.db["artists"]
+        self.artists_collection.create_index("aliases")
+        self.sale_alerts_collection = self.db["sale_alerts"]
+        self.sale_alerts_collection.create_index("sale_start")
+        self.source_polls_collection = self.db["source_polls"]
         logger.info("Loaded collections")
+        self.seed_artist_aliases(config.artist_aliases)
 
     def check_if_user_exists(self, user_id: int, raise_exception: bool = False) -> bool:
         if self.user_collection.count_documents({"_id": user_id}) > 0:
@@ -95,13 +117,17 @@ class Database:
         self.user_collection.update_one({"_id": user_id}, {"$set": {"shown_standups_id": standups_id}})
         return standups_id
 
-    def fetch_singers(self, user_id: int) -> List[str]:
+    def fetch_singer_ids(self, user_id: int) -> List[str]:
         self.check_if_user_exists(user_id, raise_exception=True)
         singers_id = self.user_collection.find_one({"_id": user_id})["singers_id"]
         return self.singers_collection.find_one({"_id": singers_id})["singers"]
 
+    def fetch_singers(self, user_id: int) -> List[str]:
+        return [artist["name"] for artist in self.fetch_artists(self.fetch_singer_ids(user_id))]
+
     def has_singer(self, user_id: int, singer: str) -> bool:
-        return singer in self.fetch_singers(user_id)
+        artist = self.find_artist(singer)
+        return artist is not None and artist["_id"] in self.fetch_singer_ids(user_id)
 
     def add_singer(self, user_id: int, singer: str):
         self.check_if_user_exists(user_id, raise_exception=True)
@@ -111,8 +137,9 @@ class Database:
             raise RuntimeError(
                 f"Cannot add more comedians! User {user_id}  has reached the size limit {self.NAMES_SIZE_LIMIT}"
             )
-        if singer not in singers:
-            singers.append(singer)
+        artist_id = self.resolve_artist(singer)
+        if artist_id not in singers:
+            singers.append(artist_id)
             logger.warning("Adding %s to user id %s list of singers", singer, user_id)
             self.singers_collection.update_one({"_id": singers_id}, {"$set": {"singers": singers}})
 
@@ -120,35 +147,46 @@ class Database:
         self.check_if_user_exists(user_id, raise_exception=True)
         singers_id = self.user_collection.find_one({"_id": user_id})["singers_id"]
         singers = self.singers_collection.find_one({"_id": singers_id})["singers"]
-        if singer in singers:
-            singers.remove(singer)
+        artist = self.find_artist(singer)
+        if artist and artist["_id"] in singers:
+            singers.remove(artist["_id"])
             logger.warning("Removing %s from user id %s list of singers", singer, user_id)
             self.singers_collection.update_one({"_id": singers_id}, {"$set": {"singers": singers}})
 
-    def add_concerts(self, user_id: int, singer: str, concerts: List[Dict]):
+    def add_concerts(self, user_id: int, artist_id: str, concerts: List[Dict]):
         self.check_if_user_exists(user_id, raise_exception=True)
         concerts_id = self.user_collection.find_one({"_id": user_id})["shown_concerts_id"]
         shown_concerts = self.shown_concerts_collection.find_one({"_id": concerts_id})["shown_concerts"]
         for concert in concerts:
-            concert_id = singer + concert["date"]
+            concert_id = artist_id + concert["date"]
             if concert_id not in shown_concerts:
                 shown_concerts.append(concert_id)
         self.shown_concerts_collection.update_one({"_id": concerts_id}, {"$set": {"shown_concerts": shown_concerts}})
 
-    def shown_concert(self, user_id: int, singer: str, concert_date: str) -> bool:
+    def remove_concerts(self, user_id: int, artist_id: str, concerts: List[Dict]):
         self.check_if_user_exists(user_id, raise_exception=True)
         concerts_id = self.user_collection.find_one({"_id": user_id})["shown_concerts_id"]
-        concert_id = singer + concert_date
+        concert_ids = [artist_id + concert["date"] for concert in concerts]
+        self.shown_concerts_collection.update_one({"_id": concerts_id}, {"$pullAll": {"shown_concerts": concert_ids}})
+
+    def shown_concert(self, user_id: int, artist_id: str, concert_date: str) -> bool:
+        self.check_if_user_exists(user_id, raise_exception=True)
+        concerts_id = self.user_collection.find_one({"_id": user_id})["shown_concerts_id"]
+        concert_id = artist_id + concert_date
         concerts = self.shown_concerts_collection.find_one({"_id": concerts_id})
         return concerts["shown_concerts"] and concert_id in concerts["shown_concerts"]
 
-    def fetch_comedians(self, user_id: int) -> List[str]:
+    def fetch_comedian_ids(self, user_id: int) -> List[str]:
         self.check_if_user_exists(user_id, raise_exception=True)
         comedians_id = self.user_collection.find_one({"_id": user_id})["comedians_id"]
         return self.comedians_collection.find_one({"_id": comedians_id})["comedians"]
 
+    def fetch_comedians(self, user_id: int) -> List[str]:
+        return [artist["name"] for artist in self.fetch_artists(self.fetch_comedian_ids(user_id))]
+
     def has_comedian(self, user_id: int, comedian: str) -> bool:
-        return comedian in self.fetch_comedians(user_id)
+        artist = self.find_artist(comedian)
+        return artist is not None and artist["_id"] in self.fetch_comedian_ids(user_id)
 
     def add_comedian(self, user_id: int, comedian: str):
         self.check_if_user_exists(user_id, raise_exception=True)
@@ -158,8 +196,9 @@ class Database:
             raise RuntimeError(
                 f"Cannot add more comedians! User {user_id}  has reached the size limit {self.NAMES_SIZE_LIMIT}"
             )
-        if comedian not in comedians:
-            comedians.append(comedian)
+        artist_id = self.resolve_artist(comedian)
+        if artist_id not in comedians:
+            comedians.append(artist_id)
             logger.warning("Adding %s to user id %s list of comedians", comedian, user_id)
             self.comedians_collection.update_one({"_id": comedians_id}, {"$set": {"comedians": comedians}})
 
@@ -167,24 +206,169 @@ class Database:
         self.check_if_user_exists(user_id, raise_exception=True)
         comedians_id = self.user_collection.find_one({"_id": user_id})["comedians_id"]
         comedians = self.comedians_collection.find_one({"_id": comedians_id})["comedians"]
-        if comedian in comedians:
-            comedians.remove(comedian)
+        artist = self.find_artist(comedian)
+        if artist and artist["_id"] in comedians:
+            comedians.remove(artist["_id"])
             logger.warning("Removing %s from user id %s list of comedians", comedian, user_id)
             self.comedians_collection.update_one({"_id": comedians_id}, {"$set": {"comedians": comedians}})
 
-    def add_standups(self, user_id: int, comedian_name: str, standups: List[Dict]):
+    def add_standups(self, user_id: int, artist_id: str, standups: List[Dict]):
         self.check_if_user_exists(user_id, raise_exception=True)
         standups_id = self.user_collection.find_one({"_id": user_id})["shown_standups_id"]
         shown_standups = self.shown_standups_collection.find_one({"_id": standups_id})["shown_standups"]
         for standup in standups:
-            standup_date = standup["show_date"]
-            id = comedian_name + standup_date
+            id = artist_id + standup["date"]
             if id not in shown_standups:
                 shown_standups.append(id)
         self.shown_standups_collection.update_one({"_id": standups_id}, {"$set": {"shown_standups": shown_standups}})
 
+    def remove_standups(self, user_id: int, artist_id: str, standups: List[Dict]):
+        self.check_if_user_exists(user_id, raise_exception=True)
+        standups_id = self.user_collection.find_one({"_id": user_id})["shown_standups_id"]
+        standup_ids = [artist_id + standup["date"] for standup in standups]
+        self.shown_standups_collection.update_one({"_id": standups_id}, {"$pullAll": {"shown_standups": standup_ids}})
+
     def shown_standup(self, user_id: int, standup_id: str) -> bool:
         self.check_if_user_exists(user_id, raise_exception=True)
         standups_id = self.user_collection.find_one({"_id": user_id})["shown_standups_id"]
         standups = self.shown_standups_collection.find_one({"_id": standups_id})
         return standups["shown_standups"] and standup_id in standups["shown_standups"]
+
+    def find_artist(self, name: str) -> Optional[Dict]:
+        return self.artists_collection.find_one({"aliases": normalize_name(name)})
+
+    def resolve_artist(self, name: str) -> str:
+        artist = self.find_artist(name)
+        if artist:
+            return artist["_id"]
+        key = normalize_name(name)
+        artist_id = str(uuid.uuid4())
+        self.artists_collection.insert_one({"_id": artist_id, "name": name.strip(), "key": key, "aliases": [key]})
+        logger.info("Registered new artist %s with id %s", name, artist_id)
+        return artist_id
+
+    def fetch_artists(self, artist_ids: List[str]) -> List[Dict]:
+        artists = {artist["_id"]: artist for artist in self.artists_collection.find({"_id": {"$in": artist_ids}})}
+        return [artists[artist_id] for artist_id in artist_ids if artist_id in artists]
+
+    def add_artist_alias(self, name: str, alias: str):
+        artist_id = self.resolve_artist(name)
+        alias_key = normalize_name(alias)
+        duplicate = self.artists_collection.find_one({"aliases": alias_key, "_id": {"$ne": artist_id}})
+        if duplicate:
+            self.merge_artists(artist_id, duplicate["_id"])
+        self.artists_collection.update_one({"_id": artist_id}, {"$addToSet": {"aliases": alias_key}})
+
+    def merge_artists(self, artist_id: str, duplicate_id: str):
+        duplicate = self.artists_collection.find_one({"_id": duplicate_id})
+        self.artists_collection.update_one(
+            {"_id": artist_id}, {"$addToSet": {"aliases": {"$each": duplicate["aliases"]}}}
+        )
+        for names_field, _, shown_field in self.ARTIST_LISTS.values():
+            for names_list in self.db[names_field].find({names_field: duplicate_id}):
+                ids = [artist_id if id == duplicate_id else id for id in names_list[names_field]]
+                self.db[names_field].update_one(
+                    {"_id": names_list["_id"]}, {"$set": {names_field: list(dict.fromkeys(ids))}}
+                )
+            self._rekey_shown(
+                shown_field, {shown_field: {"$regex": f"^{re.escape(duplicate_id)}"}}, {duplicate_id: artist_id}
+            )
+        self.artists_collection.delete_one({"_id": duplicate_id})
+        logger.info("Merged artist %s into %s", duplicate_id, artist_id)
+
+    def seed_artist_aliases(self, aliases: Dict[str, List[str]]):
+        for name, names in aliases.items():
+            for alias in names:
+                self.add_artist_alias(name, alias)
+
+    def fetch_artist_subscribers(self, list_field: str) -> Dict[str, List[Dict]]:
+        names_field, _, _ = self.ARTIST_LISTS[list_field]
+        subscribers = {}
+        for user in self.user_collection.find({list_field: {"$ne": None}}):
+            names_list = self.db[names_field].find_one({"_id": user[list_field]})
+            for artist_id in names_list[names_field] if names_list else []:
+                subscribers.setdefault(artist_id, []).append(user)
+        return subscribers
+
+    def fetch_subscribers_of_artist(self, list_field: str, artist_id: str) -> List[Dict]:
+        names_field, _, _ = self.ARTIST_LISTS[list_field]
+        list_ids = [names_list["_id"] for names_list in self.db[names_field].find({names_field: artist_id}, {"_id": 1})]
+        return list(self.user_collection.find({list_field: {"$in": list_ids}})) if list_ids else []
+
+    def migrate_names_to_artists(self):
+        # Lists used to hold free text names, swap them for artist ids and re-key the events already shown
+        for user in self.user_collection.find():
+            for list_field, (names_field, shown_list_field, shown_field) in self.ARTIST_LISTS.items():
+                names_list = self.db[names_field].find_one({"_id": user.get(list_field)})
+                if not names_list:
+                    continue
+                names = names_list[names_field]
+                known_ids = {artist["_id"] for artist in self.artists_collection.find({"_id": {"$in": names}})}
+                renames = {name: self.resolve_artist(name) for name in names if name not in known_ids}
+                if not renames:
+                    continue
+                ids = [renames.get(name, name) for name in names]
+                self.db[names_field].update_one(
+                    {"_id": names_list["_id"]}, {"$set": {names_field: list(dict.fromkeys(ids))}}
+                )
+                self._rekey_shown(shown_field, {"_id": user[shown_list_field]}, renames)
+                logger.info("Migrated %s of user %s to artist ids", names_field, user["_id"])
+
+    def _rekey_shown(self, shown_field: str, query: Dict, renames: Dict[str, str]):
+        for shown in self.db[shown_field].find(query):
+            rekeyed = []
+            for shown_id in shown[shown_field]:
+                # split on the date, a name may be the start of another name
+                match = SHOWN_ID_REGEX.match(shown_id)
+                if match and match.group(1) in renames:
+                    shown_id = renames[match.group(1)] + match.group(2)
+                rekeyed.append(shown_id)
+            if rekeyed != shown[shown_field]:
+                self.db[shown_field].update_one(
+                    {"_id": shown["_id"]}, {"$set": {shown_field: list(dict.fromkeys(rekeyed))}}
+                )
+
+    def normalize_shown_dates(self):
+        # Events are now merged across sites under a single minute precision date, drop the seconds from old ids
+        for _, _, shown_field in self.ARTIST_LISTS.values():
+            for shown in self.db[shown_field].find({shown_field: {"$regex": SHOWN_DATE_SECONDS_REGEX.pattern}}):
+                shown_ids = [SHOWN_DATE_SECONDS_REGEX.sub(r"\1\2", shown_id) for shown_id in shown[shown_field]]
+                self.db[shown_field].update_one(
+                    {"_id": shown["_id"]}, {"$set": {shown_field: list(dict.fromkeys(shown_ids))}}
+                )
+
+    def fetch_source_change_rates(self) -> Dict[str, float]:
+        return {poll["_id"]: poll["change_rate"] for poll in self.source_polls_collection.find()}
+
+    def save_source_change_rate(self, source: str, change_rate: float):
+        self.source_polls_collection.update_one({"_id": source}, {"$set": {"change_rate": change_rate}}, upsert=True)
+
+    def add_sale_alert(
+        self, artist_id: str, category: str, event: Dict, sale_start: datetime.datetime
+    ) -> Optional[str]:
+        alert_id = artist_id + event["date"]
+        result = self.sale_alerts_collection.update_one(
+            {"_id": alert_id},
+            {
+                "$setOnInsert": {
+                    "artist_id": artist_id,
+                    "category": category,
+                    "event": event,
+                    "sale_start": sale_start,
+                }
+            },
+            upsert=True,
+        )
+        if result.upserted_id is None:
+            return None
+        logger.info("Added sale alert %s at %s", alert_id, sale_start)
+        return alert_id
+
+    def fetch_pending_sale_alerts(self) -> List[Dict]:
+        return list(self.sale_alerts_collection.find().sort("sale_start", pymongo.ASCENDING))
+
+    def fetch_sale_alert(self, alert_id: str) -> Optional[Dict]:
+        return self.sale_alerts_collection.find_one({"_id": alert_id})
+
+    def remove_sale_alert(self, alert_id: str):
+        self.sale_alerts_collection.delete_one({"_id": alert_id})
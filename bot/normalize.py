@@ -0,0 +1,14 @@
+import re
+import unicodedata
+
+
+PUNCTUATION_REGEX = re.compile(r"""["'`׳״.,\-_:;!?()\[\]]+""")
+WHITESPACE_REGEX = re.compile(r"\s+")
+
+
+def normalize_name(name: str) -> str:
+    # Hebrew niqqud and Latin accents are combining marks, dropping them lets "Beyoncé" match "beyonce"
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(char for char in name if not unicodedata.combining(char))
+    name = PUNCTUATION_REGEX.sub(" ", name.casefold())
+    return WHITESPACE_REGEX.sub(" ", name).strip()
@@ -0,0 +1,59 @@
+from typing import Callable, Dict, List, Optional, Tuple
+import math
+import time
+import uuid
+
+
+class ResultPages:
+    def __init__(self, ttl: int, page_size: int, page_length: int):
+        self.ttl = ttl
+        self.page_size = page_size
+        self.page_length = page_length
+        self.results: Dict[str, Dict] = {}
+
+    def prune(self):
+        now = time.monotonic()
+        for key in [key for key, result in self.results.items() if result["expires_at"] < now]:
+            del self.results[key]
+
+    def add(
+        self,
+        header: str,
+        items: List[Dict],
+        format_item: Callable[[Dict], str],
+        parse_mode: Optional[str] = None,
+        footer: str = "",
+    ) -> str:
+        self.prune()
+        key = uuid.uuid4().hex[:16]
+        self.results[key] = {
+            "header": header,
+            "items": items,
+            "format_item": format_item,
+            "parse_mode": parse_mode,
+            "footer": footer,
+            "expires_at": time.monotonic() + self.ttl,
+        }
+        return key
+
+    def update(self, key: str, **fields):
+        self.results[key].update(fields)
+
+    def parse_mode(self, key: str) -> Optional[str]:
+        return self.results[key]["parse_mode"]
+
+    def render(self, key: str, page: int) -> Optional[Tuple[str, int]]:
+        # Pages are formatted only when shown, a result nobody pages through costs a single page
+        result = self.results.get(key)
+        if result is None or result["expires_at"] < time.monotonic():
+            return None
+        page_count = max(math.ceil(len(result["items"]) / self.page_size), 1)
+        page = min(max(page, 0), page_count - 1)
+        items = result["items"][page * self.page_size : (page + 1) * self.page_size]
+        text = result["header"] + "\n\n".join(result["format_item"](item) for item in items)
+        text = text[: self.page_length]
+        if page_count > 1:
+            text += f"\nעמוד {page + 1}/{page_count}"
+        if result["footer"]:
+            text += "\n" + result["footer"]
+        return text, page_count
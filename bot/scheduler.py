@@ -0,0 +1,76 @@
+from typing import Dict, List, Optional, Set, Tuple
+import datetime
+import heapq
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptivePoller:
+    def __init__(
+        self,
+        min_interval: int,
+        max_interval: int,
+        smoothing: float,
+        initial_interval: int,
+        change_rates: Optional[Dict[str, float]] = None,
+    ):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.smoothing = smoothing
+        # Change rate of a source never observed, the one polling it every initial_interval seconds
+        span = max_interval - min_interval
+        self.initial_change_rate = min(max((max_interval - initial_interval) / span, 0.0), 1.0) if span else 1.0
+        # rates learned before a restart, so a deploy does not reset every source's pace
+        self.change_rates: Dict[str, float] = dict(change_rates or {})
+        self.snapshots: Dict[str, Set[Tuple[str, str, str]]] = {}
+
+    def change_rate(self, source: str) -> float:
+        return self.change_rates.get(source, self.initial_change_rate)
+
+    def interval(self, source: str) -> int:
+        return round(self.max_interval - (self.max_interval - self.min_interval) * self.change_rate(source))
+
+    def observe(self, source: str, events: Optional[List[Dict]]) -> int:
+        # A failed poll tells nothing about the site, keep polling it at the same pace
+        if events is None:
+            return self.interval(source)
+        snapshot = {(event["title"], event["date"], event["venue"]) for event in events}
+        previous = self.snapshots.get(source)
+        self.snapshots[source] = snapshot
+        if previous is not None:
+            changed = bool(snapshot - previous)
+            self.change_rates[source] = (1 - self.smoothing) * self.change_rate(source) + self.smoothing * changed
+        interval = self.interval(source)
+        logger.info(
+            "Source %s change rate is %.2f, polling again in %s seconds",
+            source,
+            self.change_rate(source),
+            interval,
+        )
+        return interval
+
+
+class SaleAlertHeap:
+    def __init__(self):
+        self.heap: List[Tuple[datetime.datetime, str]] = []
+        self.alert_ids: Set[str] = set()
+        # time the alerts job is currently set to run at, if any
+        self.scheduled_at: Optional[datetime.datetime] = None
+
+    def push(self, sale_start: datetime.datetime, alert_id: str):
+        if alert_id not in self.alert_ids:
+            self.alert_ids.add(alert_id)
+            heapq.heappush(self.heap, (sale_start, alert_id))
+
+    def peek(self) -> Optional[datetime.datetime]:
+        return self.heap[0][0] if self.heap else None
+
+    def pop_due(self, now: datetime.datetime) -> List[Tuple[datetime.datetime, str]]:
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            sale_start, alert_id = heapq.heappop(self.heap)
+            self.alert_ids.discard(alert_id)
+            due.append((sale_start, alert_id))
+        return due
@@ -0,0 +1,73 @@
+from typing import Dict, List, Set, Tuple
+
+from normalize import normalize_name
+
+
+class TrieNode:
+    __slots__ = ("children", "entry_ids")
+
+    def __init__(self):
+        self.children: Dict[str, "TrieNode"] = {}
+        # every entry having a word starting with the prefix leading here
+        self.entry_ids: Set[str] = set()
+
+
+class PrefixIndex:
+    def __init__(self):
+        self.root = TrieNode()
+        self.entries: Dict[str, Dict] = {}
+        self.entry_words: Dict[str, Set[str]] = {}
+        self.groups: Dict[str, Set[str]] = {}
+
+    def _add(self, entry_id: str, entry: Dict, words: Set[str]):
+        self.entries[entry_id] = entry
+        self.entry_words[entry_id] = words
+        for word in words:
+            node = self.root
+            for char in word:
+                node = node.children.setdefault(char, TrieNode())
+                node.entry_ids.add(entry_id)
+
+    def _remove(self, entry_id: str):
+        del self.entries[entry_id]
+        for word in self.entry_words.pop(entry_id):
+            node = self.root
+            path = []
+            for char in word:
+                path.append((node, char))
+                node = node.children[char]
+                node.entry_ids.discard(entry_id)
+            # prune the branches no entry goes through anymore
+            for parent, char in reversed(path):
+                if parent.children[char].entry_ids:
+                    break
+                del parent.children[char]
+
+    def replace_group(self, group: str, entries: Dict[str, Tuple[Dict, Set[str]]]):
+        # Only entries that appeared, disappeared or changed their words touch the trie
+        previous = self.groups.get(group, set())
+        for entry_id in previous - entries.keys():
+            self._remove(entry_id)
+        for entry_id, (entry, words) in entries.items():
+            if entry_id in previous:
+                if self.entry_words[entry_id] == words:
+                    self.entries[entry_id] = entry
+                    continue
+                self._remove(entry_id)
+            self._add(entry_id, entry, words)
+        self.groups[group] = set(entries)
+
+    def search(self, query: str) -> List[Dict]:
+        entry_ids = None
+        for prefix in normalize_name(query).split():
+            node = self.root
+            for char in prefix:
+                node = node.children.get(char)
+                if node is None:
+                    return []
+            entry_ids = node.entry_ids if entry_ids is None else entry_ids & node.entry_ids
+        return [self.entries[entry_id] for entry_id in entry_ids or ()]
+
+
+def index_words(*texts: str) -> Set[str]:
+    return {word for text in texts for word in normalize_name(text).split()}
@@ -0,0 +1,33 @@
+from typing import Dict
+from urllib.parse import urlsplit
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+
+
+class Transport:
+    def __init__(self, pool_connections: int, pool_maxsize: int, per_host_limit: int, timeout: float):
+        # One long lived session keeps connections alive, so every host pays its TCP and TLS handshakes once
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # urllib3 advertises brotli only when it is installed and able to decode it
+        self.session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+        self.host_limits: Dict[str, threading.BoundedSemaphore] = {}
+        self.host_limits_lock = threading.Lock()
+
+    def host_limit(self, host: str) -> threading.BoundedSemaphore:
+        with self.host_limits_lock:
+            if host not in self.host_limits:
+                self.host_limits[host] = threading.BoundedSemaphore(self.per_host_limit)
+            return self.host_limits[host]
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        with self.host_limit(urlsplit(url).netloc):
+            return self.session.get(url, **kwargs)
@@ -0,0 +1,95 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "GigMaster", "username": "GigMasterBot"}
+# methods answering with a sent or edited message, everything else answers True
+MESSAGE_METHODS = {"sendMessage", "editMessageText"}
+
+
+# Records every Bot API call and answers like Telegram would, refusing some sends with RetryAfter if asked to
+class FakeBotApi:
+    def __init__(self, port: int = 0, retry_after_rate: float = 0.0, retry_after: int = 1):
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+        self.calls: List[Tuple[float, str, Optional[int]]] = []
+        self.retry_afters = 0
+        self.lock = threading.Lock()
+        self.message_id = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self.handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}/bot"
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def sends(self, since: float = 0.0) -> List[Tuple[float, str, Optional[int]]]:
+        with self.lock:
+            return [call for call in self.calls if call[0] >= since and call[1] in MESSAGE_METHODS]
+
+    def answer(self, method: str, params: Dict) -> Tuple[int, Dict]:
+        chat_id = int(params["chat_id"]) if params.get("chat_id") else None
+        with self.lock:
+            if method == "sendMessage" and random.random() < self.retry_after_rate:
+                self.retry_afters += 1
+                return 429, {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                }
+            self.calls.append((time.monotonic(), method, chat_id))
+            self.message_id += 1
+            message_id = int(params.get("message_id") or self.message_id)
+        if method == "getMe":
+            return 200, {"ok": True, "result": BOT_USER}
+        if method in MESSAGE_METHODS:
+            message = {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+            return 200, {"ok": True, "result": message}
+        return 200, {"ok": True, "result": True}
+
+    def handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+                if self.headers.get("Content-Type", "").startswith("application/json"):
+                    params = json.loads(body or "{}")
+                else:
+                    params = dict(parse_qsl(body))
+                status, payload = api.answer(self.path.rsplit("/", 1)[-1], params)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
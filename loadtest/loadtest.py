@@ -0,0 +1,279 @@
+import argparse
+import asyncio
+import datetime
+import logging
+import os
+import random
+import resource
+import sys
+import time
+from typing import Dict, List
+
+from telegram import Update
+from telegram.ext import ApplicationBuilder, CallbackContext, Job
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bot"))
+
+import config  # noqa: E402
+from fake_bot_api import BOT_USER, FakeBotApi  # noqa: E402
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+logger = logging.getLogger("loadtest")
+
+SEED_COLLECTIONS = (
+    "users",
+    "singers",
+    "comedians",
+    "shown_concerts",
+    "shown_standups",
+    "artists",
+    "sale_alerts",
+    "source_polls",
+)
+CONCERT_SOURCES = ("Kupat", "Leaan", "Eventim")
+STANDUP_SOURCES = ("Castilia", "Comedy Bar", "Eventim", "Leaan")
+# Kupat and Leaan report minutes, the other sites add seconds, so the same show exercises the deduplication
+SOURCE_DATE_FORMATS = {
+    "Kupat": "%H:%M %d/%m/%Y",
+    "Leaan": "%H:%M %d/%m/%Y",
+    "Eventim": "%H:%M:%S %d/%m/%Y",
+    "Castilia": "%H:%M:%S %d/%m/%Y",
+    "Comedy Bar": "%H:%M:%S %d/%m/%Y",
+}
+PERCENTILES = (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))
+VENUES = ("היכל מנורה מבטחים, תל אביב", "זאפה הרצליה", "בארבי, תל אביב", "היכל התרבות, ראשון לציון")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Load test a single gigmaster instance against a fake Bot API")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--artists", type=int, default=None, help="defaults to a twentieth of the users")
+    parser.add_argument("--zipf-exponent", type=float, default=1.1, help="long tail of the artists popularity")
+    parser.add_argument("--singers-per-user", type=int, default=8)
+    parser.add_argument("--comedians-per-user", type=int, default=2)
+    parser.add_argument("--events-ratio", type=float, default=0.3, help="fraction of the artists currently touring")
+    parser.add_argument("--cycles", type=int, default=2)
+    parser.add_argument("--conversations", type=int, default=50, help="interactive searches during every cycle")
+    parser.add_argument("--retry-after-rate", type=float, default=0.0, help="fraction of sends refused with 429")
+    parser.add_argument("--upstream-delay", type=float, default=0.2, help="seconds every fake site takes to answer")
+    parser.add_argument("--mongodb-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--database", default="gigmaster_loadtest")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.database == "gigmaster":
+        parser.error("refusing to seed the production database")
+    args.artists = args.artists or max(args.users // 20, 50)
+    return args
+
+
+def pick_artists(rng: random.Random, artist_ids: List[str], weights: List[float], count: int) -> List[str]:
+    return list(dict.fromkeys(rng.choices(artist_ids, weights=weights, k=rng.randint(0, count))))
+
+
+def seed(db, args: argparse.Namespace, rng: random.Random) -> List[Dict]:
+    for name in SEED_COLLECTIONS:
+        db.db[name].drop()
+    db.artists_collection.create_index("aliases")
+    db.singers_collection.create_index("singers")
+    db.comedians_collection.create_index("comedians")
+    artists = [
+        {"_id": f"artist-{i}", "name": f"Artist {i:06d}", "key": f"artist {i:06d}", "aliases": [f"artist {i:06d}"]}
+        for i in range(args.artists)
+    ]
+    db.artists_collection.insert_many(artists)
+    singer_ids = [artist["_id"] for artist in artists[: args.artists // 2]]
+    comedian_ids = [artist["_id"] for artist in artists[args.artists // 2 :]]
+    singer_weights = [1 / (rank + 1) ** args.zipf_exponent for rank in range(len(singer_ids))]
+    comedian_weights = [1 / (rank + 1) ** args.zipf_exponent for rank in range(len(comedian_ids))]
+    batch: Dict[str, List[Dict]] = {name: [] for name in SEED_COLLECTIONS[:5]}
+    for user_id in range(1, args.users + 1):
+        batch["users"].append(
+            {
+                "_id": user_id,
+                "chat_id": user_id,
+                "username": f"user{user_id}",
+                "first_name": "Load",
+                "last_name": "Test",
+                "singers_id": f"singers-{user_id}",
+                "shown_concerts_id": f"shown-concerts-{user_id}",
+                "comedians_id": f"comedians-{user_id}",
+                "shown_standups_id": f"shown-standups-{user_id}",
+            }
+        )
+        singers = pick_artists(rng, singer_ids, singer_weights, min(args.singers_per_user, db.NAMES_SIZE_LIMIT))
+        comedians = pick_artists(rng, comedian_ids, comedian_weights, min(args.comedians_per_user, db.NAMES_SIZE_LIMIT))
+        batch["singers"].append({"_id": f"singers-{user_id}", "singers": singers})
+        batch["comedians"].append({"_id": f"comedians-{user_id}", "comedians": comedians})
+        batch["shown_concerts"].append({"_id": f"shown-concerts-{user_id}", "shown_concerts": []})
+        batch["shown_standups"].append({"_id": f"shown-standups-{user_id}", "shown_standups": []})
+        if user_id % 10000 == 0 or user_id == args.users:
+            for name, documents in batch.items():
+                db.db[name].insert_many(documents)
+                documents.clear()
+    logger.info("Seeded %s users following %s artists", args.users, args.artists)
+    return artists
+
+
+def build_catalog(
+    artists: List[Dict], sources: tuple, events_ratio: float, rng: random.Random
+) -> Dict[str, List[Dict]]:
+    catalog: Dict[str, List[Dict]] = {source: [] for source in sources}
+    now = datetime.datetime.now().replace(second=0, microsecond=0)
+    for artist in artists:
+        if rng.random() >= events_ratio:
+            continue
+        for _ in range(rng.randint(1, 4)):
+            start = now + datetime.timedelta(days=rng.randint(7, 180), hours=rng.randint(0, 23))
+            venue = rng.choice(VENUES)
+            for source in rng.sample(sources, rng.randint(1, 2)):
+                catalog[source].append(
+                    {
+                        "title": f"{artist['name']} - הופעה",
+                        "date": start.strftime(SOURCE_DATE_FORMATS[source]),
+                        "venue": venue,
+                        "ticketSaleStart": None,
+                        "ticketSaleStop": None,
+                        "url": f"https://{source.replace(' ', '').lower()}.example/{artist['_id']}/{start:%Y%m%d%H}",
+                    }
+                )
+    return catalog
+
+
+def fake_sources(catalog: Dict[str, List[Dict]], delay: float):
+    def fetch(source: str, search_term=None) -> List[Dict]:
+        time.sleep(delay)
+        if search_term:
+            return [event for event in catalog[source] if search_term in event["title"]]
+        return list(catalog[source])
+
+    def get_sources(eventim_search_term=None):
+        return {
+            source: (lambda source=source: fetch(source, eventim_search_term if source == "Eventim" else None))
+            for source in catalog
+        }
+
+    return get_sources
+
+
+def mongo_ops(db) -> int:
+    counters = db.client.admin.command("serverStatus")["opcounters"]
+    return sum(counters.values())
+
+
+def percentiles(values: List[float]) -> str:
+    if not values:
+        return "n/a"
+    values = sorted(values)
+    picks = [(name, values[min(int(len(values) * ratio), len(values) - 1)]) for name, ratio in PERCENTILES]
+    return ", ".join(f"{name} {value:.2f}s" for name, value in picks) + f", max {values[-1]:.2f}s"
+
+
+async def converse(app, user_id: int, search_state: str, names: str) -> float:
+    # /singer, the search button and then the names, the same steps a user takes
+    user = {"id": user_id, "is_bot": False, "first_name": f"Conversation {user_id}"}
+    chat = {"id": user_id, "type": "private"}
+    updates = [
+        {
+            "message": {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": chat,
+                "from": user,
+                "text": "/singer",
+                "entities": [{"type": "bot_command", "offset": 0, "length": 7}],
+            }
+        },
+        {
+            "callback_query": {
+                "id": str(user_id),
+                "from": user,
+                "chat_instance": str(user_id),
+                "data": search_state,
+                "message": {"message_id": 2, "date": int(time.time()), "chat": chat, "from": BOT_USER, "text": "menu"},
+            }
+        },
+        {"message": {"message_id": 3, "date": int(time.time()), "chat": chat, "from": user, "text": names}},
+    ]
+    start = time.monotonic()
+    for update_id, update in enumerate(updates, start=user_id * 10):
+        await app.process_update(Update.de_json(dict(update, update_id=update_id), app.bot))
+    return time.monotonic() - start
+
+
+async def run_cycle(app, bot, api: FakeBotApi, args: argparse.Namespace, artists: List[Dict], cycle: int):
+    jobs = [Job(bot.search_shows_for_users, data=source, name=f"concerts:{source}") for source in CONCERT_SOURCES]
+    jobs += [Job(bot.search_standups_for_users, data=source, name=f"standups:{source}") for source in STANDUP_SOURCES]
+    errors = 0
+
+    async def run_job(job: Job):
+        nonlocal errors
+        try:
+            await job.callback(CallbackContext.from_job(job, app))
+        except Exception:
+            errors += 1
+            logger.exception("Job %s failed", job.name)
+
+    async def run_jobs() -> float:
+        await asyncio.gather(*(run_job(job) for job in jobs))
+        return time.monotonic() - start
+
+    # conversations come from users outside of the seeded ones so their replies are not counted as notifications
+    first_conversation_user = args.users + 1 + cycle * args.conversations
+    conversation_users = range(first_conversation_user, first_conversation_user + args.conversations)
+    search_state = str(bot.States.SEARCH_SINGER.value)
+    ops_before = mongo_ops(bot.db)
+    retry_afters_before = api.retry_afters
+    start = time.monotonic()
+    results = await asyncio.gather(
+        run_jobs(),
+        *(converse(app, user_id, search_state, random.choice(artists)["name"]) for user_id in conversation_users),
+        return_exceptions=True,
+    )
+    cycle_time, conversation_times = results[0], [result for result in results[1:] if isinstance(result, float)]
+    subscribers = set(range(1, args.users + 1))
+    latencies = [sent_at - start for sent_at, method, chat_id in api.sends(since=start) if chat_id in subscribers]
+    print(f"cycle {cycle + 1}:")
+    print(f"  wall time: {cycle_time:.2f}s, failed jobs: {errors}")
+    print(f"  notifications: {len(latencies)} ({percentiles(latencies)})")
+    print(f"  conversations: {len(conversation_times)}/{args.conversations} ({percentiles(conversation_times)})")
+    retry_afters = api.retry_afters - retry_afters_before
+    print(f"  mongo ops: {mongo_ops(bot.db) - ops_before}, RetryAfter injected: {retry_afters}")
+
+
+async def main(args: argparse.Namespace):
+    config.mongodb_uri = args.mongodb_uri
+    config.mongodb_database = args.database
+    config.telegram_token = config.telegram_token or "123456:loadtest"
+    # imported only now since bot connects to Mongo on import
+    import api_queries
+    import bot
+
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+    artists = seed(bot.db, args, rng)
+    singers, comedians = artists[: args.artists // 2], artists[args.artists // 2 :]
+    api_queries.get_concert_sources = fake_sources(
+        build_catalog(singers, CONCERT_SOURCES, args.events_ratio, rng), args.upstream_delay
+    )
+    api_queries.get_standup_sources = fake_sources(
+        build_catalog(comedians, STANDUP_SOURCES, args.events_ratio, rng), args.upstream_delay
+    )
+
+    api = FakeBotApi(retry_after_rate=args.retry_after_rate)
+    api.start()
+    app = ApplicationBuilder().token(config.telegram_token).base_url(api.base_url).concurrent_updates(True).build()
+    bot.add_handlers(app)
+    await app.initialize()
+    try:
+        for cycle in range(args.cycles):
+            await run_cycle(app, bot, api, args, singers, cycle)
+    finally:
+        await app.shutdown()
+        api.stop()
+    # ru_maxrss is reported in kilobytes on Linux
+    print(f"peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))